@@ -1,18 +1,17 @@
-import archs4py.data
-import archs4py.download
-import archs4py.meta
-import archs4py.utils
-import archs4py.align
-
 import importlib
-importlib.reload(archs4py.data)
-importlib.reload(archs4py.download)
-importlib.reload(archs4py.meta)
-importlib.reload(archs4py.utils)
-importlib.reload(archs4py.align)
-
-from archs4py.utils import versions
-from archs4py.utils import normalize
-from archs4py.utils import ls
 
 __version__="0.2.18"
+
+_submodules = ["align", "data", "download", "export", "meta", "profiling", "summary", "utils"]
+_utils_functions = ["versions", "normalize", "ls"]
+
+def __getattr__(name):
+    # submodules and their heavy dependencies (h5py, pandas, s3fs, qnorm, wget, xalign, biomart) are only imported on first access
+    if name in _submodules:
+        return importlib.import_module("archs4py." + name)
+    if name in _utils_functions:
+        return getattr(importlib.import_module("archs4py.utils"), name)
+    raise AttributeError("module 'archs4py' has no attribute " + repr(name))
+
+def __dir__():
+    return sorted(list(globals().keys()) + _submodules + _utils_functions)
@@ -1,6 +1,9 @@
-import xalign
+try:
+    import xalign
+    import biomart
+except ImportError:
+    raise ImportError("archs4py.align requires the optional alignment dependencies. Install them with: pip install archs4py[align]")
 import archs4py
-import biomart
 import numpy as np
 import pandas as pd
 
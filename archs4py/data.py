@@ -2,12 +2,24 @@ import numpy as np
 import pandas as pd
 
 import h5py as h5
-import s3fs
 import tqdm
 import re
 
+import os
+import shutil
 import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
 import random
+import contextlib
+import weakref
+import atexit
+import time
+import warnings
+
+from archs4py import profiling
+
+PROCESSES = 16
+_pool = None
 
 def resolve_url(url):
     u1 = url.rsplit('/', 1)
@@ -18,13 +30,38 @@ def resolve_url(url):
     S3_URL = "s3://"+bucket_name+"/"+file_name
     return(S3_URL, endpoint)
 
+def s3_filesystem(endpoint):
+    try:
+        import s3fs
+    except ImportError:
+        raise ImportError("Reading remote ARCHS4 files requires s3fs. Install it with: pip install archs4py[remote]")
+    return s3fs.S3FileSystem(anon=True, client_kwargs={'endpoint_url': endpoint})
+
+@contextlib.contextmanager
+def open_remote(s3, s3_url):
+    with s3.open(s3_url, 'rb') as fo:
+        with h5.File(fo, 'r', lib_version='latest') as f:
+            yield f
+        if profiling.enabled():
+            # fsspec counts the range requests (cache misses) and the reads served from its block cache
+            cache = getattr(fo, "cache", None)
+            profiling.count("remote_requests", getattr(cache, "miss_count", 0))
+            profiling.count("cache_hits", getattr(cache, "hit_count", 0))
+            profiling.count("remote_bytes", getattr(cache, "total_requested_bytes", 0))
+
+def chunks_touched(dset, sample_idx):
+    if dset.chunks is None:
+        return 0
+    row_chunks = -(-dset.shape[0] // dset.chunks[0])
+    return row_chunks * len(set(i // dset.chunks[1] for i in sample_idx))
+
 def fetch_meta_remote(field, s3_url, endpoint):
-    s3 = s3fs.S3FileSystem(anon=True, client_kwargs={'endpoint_url': endpoint})
-    with h5.File(s3.open(s3_url, 'rb'), 'r', lib_version='latest') as f:
+    s3 = s3_filesystem(endpoint)
+    with open_remote(s3, s3_url) as f:
         meta = [x.decode("UTF-8") for x in list(np.array(f[field]))]
     return np.array(meta)
 
-def meta(file, search_term, meta_fields=["geo_accession", "series_id", "characteristics_ch1", "extract_protocol_ch1", "source_name_ch1", "title"],  remove_sc=False, silent=False):
+def meta(file, search_term, meta_fields=["geo_accession", "series_id", "characteristics_ch1", "extract_protocol_ch1", "source_name_ch1", "title"],  remove_sc=False, silent=False, retries=3, backoff=0.5):
     """
     Search for samples in a file based on a search term in specified metadata fields.
 
@@ -36,6 +73,8 @@ def meta(file, search_term, meta_fields=["geo_accession", "series_id", "characte
         remove_sc (bool, optional): Whether to filter single-cell samples from the results.
             Defaults to False.
         silent (bool, optional): Print progress bar.
+        retries (int, optional): Number of times samples that failed to read are retried. Defaults to 3.
+        backoff (float, optional): Delay in seconds before the first retry, doubled for every further retry. Defaults to 0.5.
 
     Returns:
         pd.DataFrame: A pandas DataFrame containing the gene expression data for the matching samples.
@@ -44,48 +83,44 @@ def meta(file, search_term, meta_fields=["geo_accession", "series_id", "characte
     if not silent:
         print("Searches for any occurrence of", search_term, "as regular expression")
     if file.startswith("http"):
-        return meta_remote(file, search_term, meta_fields, remove_sc, silent)
+        return meta_remote(file, search_term, meta_fields, remove_sc, silent, retries, backoff)
     else:
-        return meta_local(file, search_term, meta_fields, remove_sc, silent)
+        return meta_local(file, search_term, meta_fields, remove_sc, silent, retries, backoff)
 
-def meta_local(file, search_term, meta_fields=["geo_accession", "series_id", "characteristics_ch1", "extract_protocol_ch1", "source_name_ch1", "title"], remove_sc=False, silent=False):
-    f = h5.File(file, "r")
-    idx = []
-    for field in meta_fields:
-        if field in f["meta"]["samples"].keys():
-            meta = [x.decode("UTF-8") for x in list(np.array(f["meta"]["samples"][field]))]
-            #idx.extend([i for i, item in enumerate(meta) if re.search(search_term, re.sub(r"_|-|'|/| |\.", "", item.upper()))])
-            idx.extend([i for i, item in enumerate(meta) if re.search(search_term, item, re.IGNORECASE)])
-    if remove_sc:
-        singleprob = np.where(np.array(f["meta/samples/singlecellprobability"]) < 0.5)[0]
-    f.close()
-    if remove_sc:
-        idx = sorted(list(set(idx).intersection(set(singleprob))))
-    else:
-        idx = sorted(list(set(idx)))
-    counts = index(file, idx, silent=silent)
+def meta_local(file, search_term, meta_fields=["geo_accession", "series_id", "characteristics_ch1", "extract_protocol_ch1", "source_name_ch1", "title"], remove_sc=False, silent=False, retries=3, backoff=0.5):
+    with h5.File(file, "r") as f:
+        idx = search_idx(f, search_term, meta_fields, remove_sc)
+    counts = index(file, idx, silent=silent, retries=retries, backoff=backoff)
     return counts
 
-def meta_remote(url, search_term, meta_fields=["geo_accession", "series_id", "characteristics_ch1", "extract_protocol_ch1", "source_name_ch1", "title"], remove_sc=False, silent=False):
+def meta_remote(url, search_term, meta_fields=["geo_accession", "series_id", "characteristics_ch1", "extract_protocol_ch1", "source_name_ch1", "title"], remove_sc=False, silent=False, retries=3, backoff=0.5):
     s3_url, endpoint = resolve_url(url)
+    s3 = s3_filesystem(endpoint)
+    with open_remote(s3, s3_url) as f:
+        idx = search_idx(f, search_term, meta_fields, remove_sc)
+    counts = index_remote(url, idx, silent=silent, retries=retries, backoff=backoff)
+    return counts
+
+def search_idx(f, search_term, meta_fields, remove_sc=False):
+    """
+    Return the sorted indices of samples in the open H5 file f whose meta_fields match the regular expression search_term.
+    """
     idx = []
-    s3 = s3fs.S3FileSystem(anon=True, client_kwargs={'endpoint_url': endpoint})
-    with h5.File(s3.open(s3_url, 'rb'), 'r', lib_version='latest') as f:
-        for field in meta_fields:
-            if field in f["meta"]["samples"].keys():
+    for field in meta_fields:
+        if field in f["meta"]["samples"].keys():
+            with profiling.phase("meta_decode"):
                 meta = [x.decode("UTF-8") for x in list(np.array(f["meta"]["samples"][field]))]
-                #idx.extend([i for i, item in enumerate(meta) if re.search(search_term, re.sub(r"_|-|'|/| |\.", "", item.upper()))])
+            #idx.extend([i for i, item in enumerate(meta) if re.search(search_term, re.sub(r"_|-|'|/| |\.", "", item.upper()))])
+            with profiling.phase("search"):
                 idx.extend([i for i, item in enumerate(meta) if re.search(search_term, item, re.IGNORECASE)])
-        if remove_sc:
-            singleprob = np.where(np.array(f["meta/samples/singlecellprobability"]) < 0.5)[0]
     if remove_sc:
+        singleprob = np.where(np.array(f["meta/samples/singlecellprobability"]) < 0.5)[0]
         idx = sorted(list(set(idx).intersection(set(singleprob))))
     else:
         idx = sorted(list(set(idx)))
-    counts = index_remote(url, idx, silent)
-    return counts
+    return idx
 
-def rand(file, number, seed=1, remove_sc=False, silent=False):
+def rand(file, number, seed=1, remove_sc=False, silent=False, retries=3, backoff=0.5):
     """
     Randomly select a specified number of samples from a file.
 
@@ -95,17 +130,19 @@ def rand(file, number, seed=1, remove_sc=False, silent=False):
         seed (int, optional): The seed value for the random number generator. Defaults to 1.
         remove_sc (bool, optional): Whether to remove single-cell samples from the selection. Defaults to False.
         silent (bool, optional): Print progress bar.
+        retries (int, optional): Number of times samples that failed to read are retried. Defaults to 3.
+        backoff (float, optional): Delay in seconds before the first retry, doubled for every further retry. Defaults to 0.5.
 
     Returns:
         pd.DataFrame: A pandas DataFrame containing the randomly selected samples' gene expression data.
     """
     random.seed(seed)
     if file.startswith("http"):
-        return rand_remote(file, number, remove_sc, silent)
+        return rand_remote(file, number, remove_sc, silent, retries, backoff)
     else:
-        return rand_local(file, number, remove_sc, silent)
+        return rand_local(file, number, remove_sc, silent, retries, backoff)
 
-def rand_local(file, number, remove_sc, silent=False):
+def rand_local(file, number, remove_sc, silent=False, retries=3, backoff=0.5):
     f = h5.File(file, "r")
     gsm_ids = [x.decode("UTF-8") for x in np.array(f["meta/samples/geo_accession"])]
     if remove_sc:
@@ -115,12 +152,12 @@ def rand_local(file, number, remove_sc, silent=False):
         idx = sorted(random.sample(list(np.where(singleprob < 0.5)[0]), number))
     else:
         idx = sorted(random.sample(range(len(gsm_ids)), number))
-    return index(file, idx, silent=silent)
+    return index(file, idx, silent=silent, retries=retries, backoff=backoff)
 
-def rand_remote(url, number, remove_sc, silent=False):
+def rand_remote(url, number, remove_sc, silent=False, retries=3, backoff=0.5):
     s3_url, endpoint = resolve_url(url)
-    s3 = s3fs.S3FileSystem(anon=True, client_kwargs={'endpoint_url': endpoint})
-    with h5.File(s3.open(s3_url, 'rb'), 'r', lib_version='latest') as f:
+    s3 = s3_filesystem(endpoint)
+    with open_remote(s3, s3_url) as f:
         number_samples = len(f["meta/samples/geo_accession"])
         if remove_sc:
             singleprob = np.array(f["meta/samples/singlecellprobability"])
@@ -128,67 +165,73 @@ def rand_remote(url, number, remove_sc, silent=False):
         idx = sorted(random.sample(list(np.where(singleprob < 0.5)[0]), number))
     else:
         idx = sorted(random.sample(range(number_samples), number))
-    return index_remote(url, idx, silent=silent)
+    return index_remote(url, idx, silent=silent, retries=retries, backoff=backoff)
 
-def series(file, series_id, silent=False):
+def series(file, series_id, silent=False, retries=3, backoff=0.5):
     """
     Retrieve samples belonging to a specific series from a file.
 
     Args:
         file (str): The file path or object containing the data.
         series_id (str): The ID of the series to retrieve samples from.
+        silent (bool, optional): Print progress bar.
+        retries (int, optional): Number of times samples that failed to read are retried. Defaults to 3.
+        backoff (float, optional): Delay in seconds before the first retry, doubled for every further retry. Defaults to 0.5.
 
     Returns:
         pd.DataFrame: A pandas DataFrame containing the gene expression data for the samples belonging to the specified series.
     """
     if file.startswith("http"):
-        return series_remote(file, series_id, silent=silent)
+        return series_remote(file, series_id, silent=silent, retries=retries, backoff=backoff)
     else:
-        return series_local(file, series_id, silent=silent)
+        return series_local(file, series_id, silent=silent, retries=retries, backoff=backoff)
 
-def series_local(file, series_id, silent=False):
-    f = h5.File(file, "r")
-    series = [x.decode("UTF-8") for x in np.array(f["meta/samples/series_id"])]
-    f.close()
-    idx = [i for i,x in enumerate(series) if x == series_id]
+def series_local(file, series_id, silent=False, retries=3, backoff=0.5):
+    with h5.File(file, "r") as f:
+        idx = series_idx(f, series_id)
     if len(idx) > 0:
-        return index(file, idx, silent=silent)
+        return index(file, idx, silent=silent, retries=retries, backoff=backoff)
 
-def series_remote(url, series_id, silent=False):
+def series_remote(url, series_id, silent=False, retries=3, backoff=0.5):
     s3_url, endpoint = resolve_url(url)
-    s3 = s3fs.S3FileSystem(anon=True, client_kwargs={'endpoint_url': endpoint})
-    with h5.File(s3.open(s3_url, 'rb'), 'r', lib_version='latest') as f:
-        series = [x.decode("UTF-8") for x in np.array(f["meta/samples/series_id"])]
-    idx = [i for i,x in enumerate(series) if x == series_id]
+    s3 = s3_filesystem(endpoint)
+    with open_remote(s3, s3_url) as f:
+        idx = series_idx(f, series_id)
     if len(idx) > 0:
-        return index_remote(url, idx, silent)
+        return index_remote(url, idx, silent=silent, retries=retries, backoff=backoff)
 
-def samples(file, sample_ids, silent=False):
+def series_idx(f, series_id):
+    with profiling.phase("meta_decode"):
+        series = [x.decode("UTF-8") for x in np.array(f["meta/samples/series_id"])]
+    return [i for i,x in enumerate(series) if x == series_id]
+
+def samples(file, sample_ids, silent=False, retries=3, backoff=0.5):
     if file.startswith("http"):
-        return samples_remote(file, sample_ids, silent=silent)
+        return samples_remote(file, sample_ids, silent=silent, retries=retries, backoff=backoff)
     else:
-        return samples_local(file, sample_ids, silent=silent)
+        return samples_local(file, sample_ids, silent=silent, retries=retries, backoff=backoff)
 
-def samples_local(file, sample_ids, silent=False):
-    sample_ids = set(sample_ids)
-    f = h5.File(file, "r")
-    samples = [x.decode("UTF-8") for x in np.array(f["meta/samples/geo_accession"])]
-    f.close()
-    idx = [i for i,x in enumerate(samples) if x in sample_ids]
+def samples_local(file, sample_ids, silent=False, retries=3, backoff=0.5):
+    with h5.File(file, "r") as f:
+        idx = samples_idx(f, sample_ids)
     if len(idx) > 0:
-        return index(file, idx, silent=silent)
+        return index(file, idx, silent=silent, retries=retries, backoff=backoff)
 
-def samples_remote(url, sample_ids, silent=False):
-    sample_ids = set(sample_ids)
+def samples_remote(url, sample_ids, silent=False, retries=3, backoff=0.5):
     s3_url, endpoint = resolve_url(url)
-    s3 = s3fs.S3FileSystem(anon=True, client_kwargs={'endpoint_url': endpoint})
-    with h5.File(s3.open(s3_url, 'rb'), 'r', lib_version='latest') as f:
-        sample_ids = [x.decode("UTF-8") for x in np.array(f["meta/samples/geo_accession"])]
-    idx = [i for i,x in enumerate(samples) if x in sample_ids]
+    s3 = s3_filesystem(endpoint)
+    with open_remote(s3, s3_url) as f:
+        idx = samples_idx(f, sample_ids)
     if len(idx) > 0:
-        return index_remote(url, idx, silent=silent)
+        return index_remote(url, idx, silent=silent, retries=retries, backoff=backoff)
 
-def index(file, sample_idx, gene_idx = [], silent=False):
+def samples_idx(f, sample_ids):
+    sample_ids = set(sample_ids)
+    with profiling.phase("meta_decode"):
+        samples = [x.decode("UTF-8") for x in np.array(f["meta/samples/geo_accession"])]
+    return [i for i,x in enumerate(samples) if x in sample_ids]
+
+def index(file, sample_idx, gene_idx = [], silent=False, retries=3, backoff=0.5):
     """
     Retrieve gene expression data from a specified file for the given sample and gene indices.
 
@@ -197,91 +240,246 @@ def index(file, sample_idx, gene_idx = [], silent=False):
         sample_idx (list): A list of sample indices to retrieve expression data for.
         gene_idx (list, optional): A list of gene indices to retrieve expression data for. Defaults to an empty list (return all).
         silent (bool, optional): Whether to disable progress bar. Defaults to False.
+        retries (int, optional): Number of times samples that failed to read are retried. Defaults to 3.
+        backoff (float, optional): Delay in seconds before the first retry, doubled for every further retry. Defaults to 0.5.
 
     Returns:
-        pd.DataFrame: A pandas DataFrame containing the gene expression data.
+        pd.DataFrame: A pandas DataFrame containing the gene expression data. Samples that could not be read after all retries
+            are zero and listed in exp.attrs["extraction_report"] (see extraction_report), and a warning is raised.
     """
     sample_idx = sorted(sample_idx)
     gene_idx = sorted(gene_idx)
     row_encoding = get_encoding(file)
     f = h5.File(file, "r")
-    genes = np.array([x.decode("UTF-8") for x in np.array(f[row_encoding])])
+    with profiling.phase("meta_decode"):
+        genes = np.array([x.decode("UTF-8") for x in np.array(f[row_encoding])])
     if len(sample_idx) == 0:
         return pd.DataFrame(index=genes[gene_idx])
-    gsm_ids = np.array([x.decode("UTF-8") for x in np.array(f["meta/samples/geo_accession"])])[sample_idx]
+    with profiling.phase("meta_decode"):
+        gsm_ids = np.array([x.decode("UTF-8") for x in np.array(f["meta/samples/geo_accession"])])[sample_idx]
+    if profiling.enabled():
+        dset = f["data/expression"]
+        profiling.count("bytes_requested", dset.shape[0]*dset.dtype.itemsize*len(sample_idx))
+        profiling.count("chunks_requested", chunks_touched(dset, sample_idx))
     f.close()
     if len(gene_idx) == 0:
         gene_idx = list(range(len(genes)))
-    exp = []
-    PROCESSES = 16
-    with multiprocessing.Pool(PROCESSES) as pool:
-        results = [pool.apply_async(get_sample, (file, i, gene_idx)) for i in sample_idx]
-        for r in tqdm.tqdm(results, disable=silent):
-            res = r.get()
-            exp.append(res)
-    exp = np.array(exp).T
-    exp = pd.DataFrame(exp, index=genes[gene_idx], columns=gsm_ids, dtype=np.uint32)
+        worker_gene_idx = None
+    else:
+        worker_gene_idx = np.array(gene_idx)
+    pool = get_pool()
+    # workers write each sample into its own row of a shared samples x genes buffer, the DataFrame wraps its transpose without copying
+    nbytes = len(sample_idx)*len(gene_idx)*np.dtype(np.uint32).itemsize
+    if shared_memory_fits(nbytes):
+        shm, matrix = shared_matrix(len(sample_idx), len(gene_idx))
+    else:
+        warnings.warn("Not enough free space in /dev/shm for {:.1f} MB, samples are copied from the workers instead".format(nbytes/1024**2))
+        shm, matrix = None, np.zeros((len(sample_idx), len(gene_idx)), dtype=np.uint32)
+    errors = {}
+    retried = set()
+    try:
+        with profiling.phase("extract"):
+            results = [submit_sample(pool, file, i, worker_gene_idx, shm, matrix.shape, row) for row, i in enumerate(sample_idx)]
+            for row, r in enumerate(tqdm.tqdm(results, disable=silent)):
+                error = collect_sample(r, shm, matrix, row)
+                if error is not None:
+                    errors[row] = error
+                profiling.count("samples")
+            # only the samples that failed are read again
+            for attempt in range(retries):
+                if len(errors) == 0:
+                    break
+                time.sleep(backoff*2**attempt)
+                retried.update(errors.keys())
+                profiling.count("retries", len(errors))
+                results = {row: submit_sample(pool, file, sample_idx[row], worker_gene_idx, shm, matrix.shape, row) for row in errors}
+                errors = {row: error for row, error in ((row, collect_sample(r, shm, matrix, row)) for row, r in results.items()) if error is not None}
+    finally:
+        if shm is not None:
+            shm.unlink()
+    with profiling.phase("assemble"):
+        exp = pd.DataFrame(matrix.T, index=genes[gene_idx], columns=gsm_ids, dtype=np.uint32, copy=False)
+    exp.attrs["extraction_report"] = extraction_report(sample_idx, gsm_ids, errors, retried, retries)
     return exp
 
-def index_remote(url, sample_idx, gene_idx = [], silent=False):
-    if len(sample_idx) == 0:
-        return pd.DataFrame(index=genes[gene_idx])
+def index_remote(url, sample_idx, gene_idx = [], silent=False, retries=3, backoff=0.5):
     s3_url, endpoint = resolve_url(url)
     sample_idx = sorted(sample_idx)
     gene_idx = sorted(gene_idx)
-    s3 = s3fs.S3FileSystem(anon=True, client_kwargs={'endpoint_url': endpoint})
-    row_encoding = get_encoding_remote(s3, url)
-    genes = fetch_meta_remote(row_encoding, s3_url, endpoint)
+    s3 = s3_filesystem(endpoint)
+    row_encoding = get_encoding_remote(s3, s3_url)
+    with profiling.phase("meta_decode"):
+        genes = fetch_meta_remote(row_encoding, s3_url, endpoint)
+    if len(sample_idx) == 0:
+        return pd.DataFrame(index=genes[gene_idx])
     if len(gene_idx) == 0:
         gene_idx = np.array(list(range(len(genes))))
-    gsm_ids = fetch_meta_remote("meta/samples/geo_accession", s3_url, endpoint)[sample_idx]
-    with h5.File(s3.open(s3_url, 'rb'), 'r', lib_version='latest') as f:
-        exp = np.array(f["data/expression"][:,np.array(sample_idx)], dtype=np.uint32)[gene_idx]
-    exp = pd.DataFrame(exp, index=genes[gene_idx], columns=gsm_ids, dtype=np.uint32)
+    with profiling.phase("meta_decode"):
+        gsm_ids = fetch_meta_remote("meta/samples/geo_accession", s3_url, endpoint)[sample_idx]
+    errors = {}
+    retried = set()
+    exp = np.zeros((len(gene_idx), len(sample_idx)), dtype=np.uint32)
+    with open_remote(s3, s3_url) as f, profiling.phase("extract"):
+        dset = f["data/expression"]
+        if profiling.enabled():
+            profiling.count("bytes_requested", dset.shape[0]*dset.dtype.itemsize*len(sample_idx))
+            profiling.count("chunks_requested", chunks_touched(dset, sample_idx))
+        # samples are read one chunk column at a time so that a failed request only repeats that block
+        block_size = dset.chunks[1] if dset.chunks is not None else 1000
+        blocks = {}
+        for pos, i in enumerate(sample_idx):
+            blocks.setdefault(i // block_size, []).append(pos)
+        for positions in tqdm.tqdm(blocks.values(), disable=silent):
+            cols = [sample_idx[pos] for pos in positions]
+            try:
+                block, attempts = read_with_retries(lambda: dset[:, cols], retries, backoff)
+                exp[:, positions] = block[gene_idx]
+                if attempts > 1:
+                    retried.update(positions)
+            except Exception as e:
+                if retries > 0:
+                    retried.update(positions)
+                errors.update({pos: repr(e) for pos in positions})
+            profiling.count("samples", len(positions))
+    with profiling.phase("assemble"):
+        exp = pd.DataFrame(exp, index=genes[gene_idx], columns=gsm_ids, dtype=np.uint32, copy=False)
+    exp.attrs["extraction_report"] = extraction_report(sample_idx, gsm_ids, errors, retried, retries)
     return exp
 
-def get_sample(file, i, gene_idx):
+def read_with_retries(read, retries=3, backoff=0.5):
+    """
+    Call read() until it succeeds, at most retries+1 times, waiting backoff*2**attempt seconds between attempts.
+
+    Returns:
+        tuple: The result of read() and the number of attempts it took.
+
+    Raises:
+        Exception: The error of the last attempt if all attempts failed.
+    """
+    for attempt in range(retries+1):
+        try:
+            return read(), attempt+1
+        except Exception:
+            if attempt == retries:
+                raise
+            profiling.count("retries")
+            time.sleep(backoff*2**attempt)
+
+def extraction_report(sample_idx, gsm_ids, errors, retried, retries):
+    """
+    Summarize the outcome of an extraction. The report is stored in exp.attrs["extraction_report"] of the returned DataFrame.
+
+    Returns:
+        dict: "failed" (sample indices that are still zero after all retries), "failed_samples" (their GEO accessions),
+            "errors" (last error per failed sample index), "retried" (sample indices that needed at least one retry)
+            and "retries" (maximum number of retries).
+    """
+    failed = sorted(errors.keys())
+    report = {
+        "failed": [int(sample_idx[pos]) for pos in failed],
+        "failed_samples": [str(gsm_ids[pos]) for pos in failed],
+        "errors": {int(sample_idx[pos]): errors[pos] for pos in failed},
+        "retried": sorted(int(sample_idx[pos]) for pos in retried),
+        "retries": retries
+    }
+    if len(failed) > 0:
+        profiling.count("failed_samples", len(failed))
+        warnings.warn("{} of {} samples could not be read and are set to zero: {}".format(len(failed), len(sample_idx), ", ".join(report["failed_samples"][:10])))
+    return report
+
+def get_pool():
+    """
+    Return the process pool used for sample extraction. The pool is created on first use and reused by later calls.
+    """
+    global _pool
+    if _pool is None:
+        with profiling.phase("pool_start"):
+            # workers must share the parent's resource tracker, otherwise each one reports the shared buffers it attached to as leaked
+            resource_tracker.ensure_running()
+            _pool = multiprocessing.Pool(PROCESSES)
+        atexit.register(close_pool)
+    return _pool
+
+def close_pool():
+    """
+    Shut down the shared extraction pool. A new pool is started by the next extraction call.
+    """
+    global _pool
+    if _pool is not None:
+        _pool.terminate()
+        _pool.join()
+        _pool = None
+        atexit.unregister(close_pool)
+
+def shared_memory_fits(nbytes):
+    # POSIX shared memory is backed by /dev/shm on Linux; writing past its free space kills the worker with SIGBUS
+    if not os.path.isdir("/dev/shm"):
+        return True
+    return nbytes <= shutil.disk_usage("/dev/shm").free
+
+def submit_sample(pool, file, i, gene_idx, shm, shape, row):
+    if shm is not None:
+        return pool.apply_async(get_sample_shared, (file, i, gene_idx, shm.name, shape, row))
+    return pool.apply_async(get_sample_copy, (file, i, gene_idx))
+
+def collect_sample(result, shm, matrix, row):
+    if shm is not None:
+        return result.get()
+    values, error = result.get()
+    if values is not None:
+        matrix[row] = values
+    return error
+
+def shared_matrix(rows, cols):
+    shm = shared_memory.SharedMemory(create=True, size=max(1, rows*cols*np.dtype(np.uint32).itemsize))
+    matrix = np.ndarray((rows, cols), dtype=np.uint32, buffer=shm.buf)
+    # the segment is zero-filled on creation and stays mapped until the last view of matrix is released
+    weakref.finalize(matrix, shm.close)
+    return shm, matrix
+
+def get_sample_shared(file, i, gene_idx, shm_name, shape, row):
+    shm = shared_memory.SharedMemory(name=shm_name)
     try:
-        f = h5.File(file, "r")
-        temp = np.array(f["data/expression"][:,i], dtype=np.uint32)[gene_idx]
-        f.close()
-    except Exception:
-        dd = np.array([0]*len(gene_idx))
-        return dd
-    return temp
-
-def get_sample_remote(s3_url, endpoint, i, gene_idx):
+        matrix = np.ndarray(shape, dtype=np.uint32, buffer=shm.buf)
+        error = None
+        try:
+            with h5.File(file, "r") as f:
+                if gene_idx is None:
+                    f["data/expression"].read_direct(matrix, np.s_[:,i], np.s_[row])
+                else:
+                    matrix[row] = f["data/expression"][:,i][gene_idx]
+        except Exception as e:
+            matrix[row] = 0
+            error = repr(e)
+        del matrix
+    finally:
+        shm.close()
+    return error
+
+def get_sample_copy(file, i, gene_idx):
     try:
-        s3 = s3fs.S3FileSystem(anon=True, client_kwargs={'endpoint_url': endpoint})
-        with h5.File(s3.open(s3_url, 'rb'), 'r', lib_version='latest') as f:
-            temp = np.array(f["data/expression"][:,i], dtype=np.uint32)[gene_idx]
-        return temp
-    except Exception:
-        dd = np.array([0]*len(gene_idx))
-        return dd
+        with h5.File(file, "r") as f:
+            values = np.array(f["data/expression"][:,i], dtype=np.uint32)
+        return (values if gene_idx is None else values[gene_idx]), None
+    except Exception as e:
+        return None, repr(e)
 
 def get_encoding(file):
-    with h5.File(file) as f:
-        if "genes" in list(f["meta"].keys()):
-            if "gene_symbol" in list(f["meta/genes"].keys()):
-                return "meta/genes/gene_symbol"
-            elif "symbol" in list(f["meta/genes"].keys()):
-                return "meta/genes/symbol"
-        elif "transcripts" in list(f["meta"].keys()):
-            if "ensembl_id" in list(f["meta/transcripts"].keys()):
-                return "meta/transcripts/ensembl_id"
-        else:
-            raise Exception("error in gene/transcript meta data")
+    with h5.File(file, "r") as f:
+        return encoding(f)
 
 def get_encoding_remote(s3, s3_url):
-    with h5.File(s3.open(s3_url, 'rb'), 'r', lib_version='latest') as f:
-        if "genes" in list(f["meta"].keys()):
-            if "gene_symbol" in list(f["meta/genes"].keys()):
-                return "meta/genes/gene_symbol"
-            elif "symbol" in list(f["meta/genes"].keys()):
-                return "meta/gene_symbol"
-        elif "transcripts" in list(f["meta"].keys()):
-            if "ensembl_id" in list(f["meta/transcripts"].keys()):
-                return "meta/transcripts/ensembl_id"
-        else:
-            raise Exception("error in gene/transcript meta data")
\ No newline at end of file
+    with open_remote(s3, s3_url) as f:
+        return encoding(f)
+
+def encoding(f):
+    if "genes" in list(f["meta"].keys()):
+        if "gene_symbol" in list(f["meta/genes"].keys()):
+            return "meta/genes/gene_symbol"
+        elif "symbol" in list(f["meta/genes"].keys()):
+            return "meta/genes/symbol"
+    elif "transcripts" in list(f["meta"].keys()):
+        if "ensembl_id" in list(f["meta/transcripts"].keys()):
+            return "meta/transcripts/ensembl_id"
+    else:
+        raise Exception("error in gene/transcript meta data")
\ No newline at end of file
@@ -1,4 +1,3 @@
-import wget
 import sys
 import requests
 import archs4py.utils
@@ -38,6 +37,7 @@ def counts(species, path="", type="GENE_COUNTS", version="latest"):
         - GENE_COUNTS: Gene-level count files.
         - TRANSCRIPT_COUNTS: Transcript-level count files.
     """
+    import wget
     conf = archs4py.utils.get_config()
 
     try:
@@ -0,0 +1,228 @@
+import numpy as np
+import pandas as pd
+import h5py as h5
+import tqdm
+
+import os
+import contextlib
+
+from archs4py import data
+from archs4py import profiling
+
+SAMPLE_FIELDS = ["geo_accession", "series_id", "characteristics_ch1", "extract_protocol_ch1", "source_name_ch1", "title"]
+
+def index(file, sample_idx, output, gene_idx=[], format=None, sample_fields=SAMPLE_FIELDS, block_size=1000, silent=False, retries=3, backoff=0.5):
+    """
+    Stream gene expression data for the given sample and gene indices from an ARCHS4 file into an output file.
+    Samples are read and written block by block, so the full expression matrix is never held in memory.
+
+    Args:
+        file (str): The file path or URL of the ARCHS4 H5 file.
+        sample_idx (list): A list of sample indices to export.
+        output (str): Path of the output file.
+        gene_idx (list, optional): A list of gene indices to export. Defaults to an empty list (export all).
+        format (str, optional): "parquet", "h5" or "h5ad". Defaults to None (inferred from the extension of output).
+            - "parquet": one row per sample, sample_fields followed by one column per gene. Duplicate gene names get a suffix (e.g. "SNORA74.1").
+            - "h5": chunked H5 file in the ARCHS4 layout (data/expression, meta/genes or meta/transcripts, meta/samples) that can be queried with archs4py.
+            - "h5ad": AnnData file with samples as observations, sample metadata in obs and gene metadata in var.
+        sample_fields (list, optional): Sample metadata fields written with the expression values.
+            Defaults to ["geo_accession", "series_id", "characteristics_ch1", "extract_protocol_ch1", "source_name_ch1", "title"].
+        block_size (int, optional): Number of samples read and written at a time. Defaults to 1000.
+        silent (bool, optional): Whether to disable progress bar. Defaults to False.
+        retries (int, optional): Number of times a failed block read is retried before the export is aborted. Defaults to 3.
+        backoff (float, optional): Delay in seconds before the first retry, doubled for every further retry. Defaults to 0.5.
+
+    Returns:
+        str: The path of the output file.
+
+    Raises:
+        ValueError: If the output format is not supported.
+    """
+    format = export_format(output, format)
+    sample_idx = sorted(sample_idx)
+    gene_idx = sorted(gene_idx)
+    with open_file(file) as f:
+        genes, gene_group, gene_meta = gene_metadata(f, gene_idx)
+        if len(gene_idx) == 0:
+            gene_idx = list(range(len(genes)))
+        sample_meta = sample_metadata(f, sample_idx, sample_fields)
+        blocks = read_blocks(f, sample_idx, gene_idx, block_size, silent, retries, backoff)
+        if format == "parquet":
+            write_parquet(output, blocks, genes, sample_meta)
+        elif format == "h5":
+            write_h5(output, blocks, genes, gene_group, gene_meta, sample_meta, len(sample_idx), block_size)
+        else:
+            write_h5ad(output, blocks, genes, gene_meta, sample_meta, len(sample_idx), block_size)
+    return output
+
+def meta(file, search_term, output, meta_fields=SAMPLE_FIELDS, remove_sc=False, **kwargs):
+    """
+    Export samples matching a search term in the specified metadata fields. See archs4py.data.meta() for the search
+    and archs4py.export.index() for the remaining arguments.
+
+    Returns:
+        str: The path of the output file.
+    """
+    with open_file(file) as f:
+        idx = data.search_idx(f, search_term, meta_fields, remove_sc)
+    return index(file, idx, output, **kwargs)
+
+def series(file, series_id, output, **kwargs):
+    """
+    Export all samples belonging to a series. See archs4py.export.index() for the remaining arguments.
+
+    Returns:
+        str: The path of the output file.
+    """
+    with open_file(file) as f:
+        idx = data.series_idx(f, series_id)
+    return index(file, idx, output, **kwargs)
+
+def samples(file, sample_ids, output, **kwargs):
+    """
+    Export samples in a list of GEO accession IDs. See archs4py.export.index() for the remaining arguments.
+
+    Returns:
+        str: The path of the output file.
+    """
+    with open_file(file) as f:
+        idx = data.samples_idx(f, sample_ids)
+    return index(file, idx, output, **kwargs)
+
+def export_format(output, format=None):
+    if format is None:
+        extension = os.path.splitext(output)[1].lower()
+        format = {".parquet": "parquet", ".pq": "parquet", ".h5": "h5", ".hdf5": "h5", ".h5ad": "h5ad"}.get(extension, extension)
+    if format not in ["parquet", "h5", "h5ad"]:
+        raise ValueError("Unsupported export format: " + str(format))
+    return format
+
+@contextlib.contextmanager
+def open_file(file):
+    if file.startswith("http"):
+        s3_url, endpoint = data.resolve_url(file)
+        with data.open_remote(data.s3_filesystem(endpoint), s3_url) as f:
+            yield f
+    else:
+        with h5.File(file, "r") as f:
+            yield f
+
+def decode(values):
+    values = np.array(values)
+    if values.dtype.kind in ("S", "O"):
+        return np.array([x.decode("UTF-8") if isinstance(x, bytes) else str(x) for x in values], dtype=object)
+    return values
+
+def gene_metadata(f, gene_idx):
+    row_encoding = data.encoding(f)
+    group_path = row_encoding.rsplit("/", 1)[0]
+    group = f[group_path]
+    with profiling.phase("meta_decode"):
+        genes = decode(f[row_encoding])
+        gene_meta = {}
+        for field in group.keys():
+            if isinstance(group[field], h5.Dataset) and group[field].shape == genes.shape:
+                gene_meta[field] = decode(group[field])
+    if len(gene_idx) > 0:
+        genes = genes[gene_idx]
+        gene_meta = {k: v[gene_idx] for k, v in gene_meta.items()}
+    return genes, group_path, gene_meta
+
+def sample_metadata(f, sample_idx, sample_fields):
+    sample_meta = {}
+    with profiling.phase("meta_decode"):
+        for field in ["geo_accession"] + [x for x in sample_fields if x != "geo_accession"]:
+            if field in f["meta/samples"].keys():
+                sample_meta[field] = decode(f["meta/samples"][field][sample_idx]) if len(sample_idx) > 0 else np.array([], dtype=object)
+    return sample_meta
+
+def read_blocks(f, sample_idx, gene_idx, block_size, silent=False, retries=3, backoff=0.5):
+    """
+    Yield (start, block) pairs, where block holds the expression of sample_idx[start:start+block_size] as a genes x samples array.
+    """
+    dset = f["data/expression"]
+    all_genes = len(gene_idx) == dset.shape[0]
+    for start in tqdm.tqdm(range(0, len(sample_idx), block_size), disable=silent):
+        cols = sample_idx[start:start+block_size]
+        with profiling.phase("extract"):
+            if cols[-1]-cols[0]+1 == len(cols):
+                block, attempts = data.read_with_retries(lambda: dset[:, cols[0]:cols[-1]+1], retries, backoff)
+            else:
+                block, attempts = data.read_with_retries(lambda: dset[:, cols], retries, backoff)
+            block = np.asarray(block, dtype=np.uint32)
+            if not all_genes:
+                block = block[gene_idx]
+        profiling.count("bytes_requested", dset.shape[0]*dset.dtype.itemsize*len(cols))
+        profiling.count("samples", len(cols))
+        yield start, block
+
+def write_parquet(output, blocks, genes, sample_meta):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet export requires pyarrow. Install it with: pip install archs4py[export]")
+    names = unique_names(list(sample_meta.keys()) + [str(x) for x in genes])
+    types = [pa.string() if v.dtype == object else pa.from_numpy_dtype(v.dtype) for v in sample_meta.values()] + [pa.uint32()]*len(genes)
+    schema = pa.schema([pa.field(name, t) for name, t in zip(names, types)])
+    # the file is created up front so that an empty selection still yields a file with the full schema
+    with pq.ParquetWriter(output, schema) as writer:
+        for start, block in blocks:
+            with profiling.phase("write"):
+                columns = [pa.array(v[start:start+block.shape[1]], type=t) for v, t in zip(sample_meta.values(), types)]
+                columns.extend(pa.array(row, type=pa.uint32()) for row in block)
+                writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+
+def unique_names(names):
+    seen = {}
+    unique = []
+    for name in names:
+        if name in seen:
+            seen[name] += 1
+            while name+"."+str(seen[name]) in seen:
+                seen[name] += 1
+            unique.append(name+"."+str(seen[name]))
+            seen[unique[-1]] = 0
+        else:
+            seen[name] = 0
+            unique.append(name)
+    return unique
+
+def write_meta_group(group, meta):
+    for field, values in meta.items():
+        if values.dtype == object:
+            group.create_dataset(field, data=values.astype(str).astype(object), dtype=h5.string_dtype())
+        else:
+            group.create_dataset(field, data=values)
+
+def write_h5(output, blocks, genes, gene_group, gene_meta, sample_meta, number_samples, block_size):
+    with h5.File(output, "w") as out:
+        expression = out.create_dataset("data/expression", shape=(len(genes), number_samples), dtype=np.uint32,
+            chunks=(min(len(genes), 2000), max(1, min(number_samples, block_size))) if number_samples > 0 else None, compression="gzip")
+        # gene and transcript files keep their meta group, so archs4py.data.encoding() finds the row names of the output
+        write_meta_group(out.create_group(gene_group), gene_meta)
+        write_meta_group(out.create_group("meta/samples"), sample_meta)
+        for start, block in blocks:
+            with profiling.phase("write"):
+                expression[:, start:start+block.shape[1]] = block
+
+def write_h5ad(output, blocks, genes, gene_meta, sample_meta, number_samples, block_size):
+    try:
+        import anndata
+    except ImportError:
+        raise ImportError("AnnData export requires anndata. Install it with: pip install archs4py[export]")
+    obs = pd.DataFrame(sample_meta)
+    obs.index = obs.pop("geo_accession") if "geo_accession" in obs.columns else obs.index.astype(str)
+    var = pd.DataFrame(gene_meta, index=[str(x) for x in genes])
+    # the AnnData object is written without X, the expression matrix is then filled in block by block
+    anndata.AnnData(obs=obs, var=var).write_h5ad(output)
+    with h5.File(output, "a") as out:
+        if "X" in out:
+            del out["X"]
+        X = out.create_dataset("X", shape=(number_samples, len(genes)), dtype=np.uint32,
+            chunks=(max(1, min(number_samples, block_size)), min(len(genes), 2000)) if number_samples > 0 else None, compression="gzip")
+        X.attrs["encoding-type"] = "array"
+        X.attrs["encoding-version"] = "0.2.0"
+        for start, block in blocks:
+            with profiling.phase("write"):
+                X[start:start+block.shape[1], :] = block.T
@@ -8,6 +8,8 @@ import numpy as np
 import pandas as pd
 import tqdm
 
+from archs4py import profiling
+
 def meta(file, search_term, meta_fields=["characteristics_ch1", "extract_protocol_ch1", "source_name_ch1", "title"], remove_sc=False, silent=False):
     """
     Search for samples in a file based on a search term in specified metadata fields.
@@ -29,16 +31,19 @@ def meta(file, search_term, meta_fields=["characteristics_ch1", "extract_protoco
         meta = []
         idx = []
         mfields = []
-        for field in tqdm.tqdm(meta_fields, disable=not silent):
-            if field in f["meta"]["samples"].keys():
-                try:
-                    meta.append([x.decode("UTF-8") for x in list(np.array(f["meta"]["samples"][field]))])
-                    mfields.append(field)
-                except Exception:
-                    x=0
-        meta = pd.DataFrame(meta, index=mfields ,columns=[x.decode("UTF-8") for x in list(np.array(f["meta"]["samples"]["geo_accession"]))])
-        for i in tqdm.tqdm(range(meta.shape[0]), disable=silent):
-            idx.extend([i for i, item in enumerate(meta.iloc[i,:]) if re.search(search_term, item, re.IGNORECASE)])
+        with profiling.phase("meta_decode"):
+            for field in tqdm.tqdm(meta_fields, disable=not silent):
+                if field in f["meta"]["samples"].keys():
+                    try:
+                        meta.append([x.decode("UTF-8") for x in list(np.array(f["meta"]["samples"][field]))])
+                        mfields.append(field)
+                    except Exception:
+                        x=0
+        with profiling.phase("assemble"):
+            meta = pd.DataFrame(meta, index=mfields ,columns=[x.decode("UTF-8") for x in list(np.array(f["meta"]["samples"]["geo_accession"]))])
+        with profiling.phase("search"):
+            for i in tqdm.tqdm(range(meta.shape[0]), disable=silent):
+                idx.extend([i for i, item in enumerate(meta.iloc[i,:]) if re.search(search_term, item, re.IGNORECASE)])
         if remove_sc:
             singleprob = np.where(np.array(f["meta/samples/singlecellprobability"]) < 0.5)[0]
             idx = sorted(list(set(idx).intersection(set(singleprob))))
@@ -91,17 +96,21 @@ def samples(file, samples, meta_fields=["geo_accession", "series_id", "character
     with h5.File(file, "r") as f:
         meta = []
         mfields = []
-        meta_samples = np.array([x.decode("UTF-8") for x in list(np.array(f["meta"]["samples"]["geo_accession"]))])
-        idx = [i for i,x in enumerate(meta_samples) if x in samples]
-        for field in tqdm.tqdm(meta_fields, disable=not silent):
-            if field in f["meta"]["samples"].keys():
-                try:
-                    meta.append([x.decode("UTF-8") for x in list(np.array(f["meta"]["samples"][field][idx]))])
-                    mfields.append(field)
-                except Exception:
-                    meta.append(list(np.array(f["meta"]["samples"][field][idx])))
-                    mfields.append(field)
-        meta = pd.DataFrame(meta, index=mfields ,columns=[x.decode("UTF-8") for x in list(np.array(f["meta"]["samples"]["geo_accession"][idx]))])
+        with profiling.phase("meta_decode"):
+            meta_samples = np.array([x.decode("UTF-8") for x in list(np.array(f["meta"]["samples"]["geo_accession"]))])
+        with profiling.phase("search"):
+            idx = [i for i,x in enumerate(meta_samples) if x in samples]
+        with profiling.phase("meta_decode"):
+            for field in tqdm.tqdm(meta_fields, disable=not silent):
+                if field in f["meta"]["samples"].keys():
+                    try:
+                        meta.append([x.decode("UTF-8") for x in list(np.array(f["meta"]["samples"][field][idx]))])
+                        mfields.append(field)
+                    except Exception:
+                        meta.append(list(np.array(f["meta"]["samples"][field][idx])))
+                        mfields.append(field)
+        with profiling.phase("assemble"):
+            meta = pd.DataFrame(meta, index=mfields ,columns=[x.decode("UTF-8") for x in list(np.array(f["meta"]["samples"]["geo_accession"][idx]))])
         inter = meta.columns.intersection(set(samples))
     return meta.loc[:,inter].T
 
@@ -121,17 +130,21 @@ def series(file, series, meta_fields=["geo_accession", "series_id", "characteris
     with h5.File(file, "r") as f:
         meta = []
         mfields = []
-        meta_series = np.array([x.decode("UTF-8") for x in list(np.array(f["meta"]["samples"]["series_id"]))])
-        idx = [i for i,x in enumerate(meta_series) if x == series]
-        for field in tqdm.tqdm(meta_fields, disable=not silent):
-            if field in f["meta"]["samples"].keys():
-                try:
-                    meta.append([x.decode("UTF-8") for x in list(np.array(f["meta"]["samples"][field][idx]))])
-                    mfields.append(field)
-                except Exception:
-                    meta.append(list(np.array(f["meta"]["samples"][field][idx])))
-                    mfields.append(field)
-        meta = pd.DataFrame(meta, index=mfields ,columns=[x.decode("UTF-8") for x in list(np.array(f["meta"]["samples"]["geo_accession"][idx]))])
+        with profiling.phase("meta_decode"):
+            meta_series = np.array([x.decode("UTF-8") for x in list(np.array(f["meta"]["samples"]["series_id"]))])
+        with profiling.phase("search"):
+            idx = [i for i,x in enumerate(meta_series) if x == series]
+        with profiling.phase("meta_decode"):
+            for field in tqdm.tqdm(meta_fields, disable=not silent):
+                if field in f["meta"]["samples"].keys():
+                    try:
+                        meta.append([x.decode("UTF-8") for x in list(np.array(f["meta"]["samples"][field][idx]))])
+                        mfields.append(field)
+                    except Exception:
+                        meta.append(list(np.array(f["meta"]["samples"][field][idx])))
+                        mfields.append(field)
+        with profiling.phase("assemble"):
+            meta = pd.DataFrame(meta, index=mfields ,columns=[x.decode("UTF-8") for x in list(np.array(f["meta"]["samples"]["geo_accession"][idx]))])
     return meta.T
 
 def get_meta(file):
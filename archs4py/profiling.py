@@ -0,0 +1,120 @@
+import time
+import contextlib
+
+_stats = None
+_null = contextlib.nullcontext()
+
+class Stats:
+    """
+    Collected timings and I/O counters of profiled archs4py calls.
+
+    Attributes:
+        timings (dict): Accumulated wall time in seconds per phase (e.g. "meta_decode", "search", "pool_start", "extract", "assemble").
+        counters (dict): Accumulated counters, among them
+            - "bytes_requested", "chunks_requested": estimates of the uncompressed expression data and the HDF5 chunks a query
+              selects (shape x itemsize), not measured reads
+            - "remote_requests", "cache_hits", "remote_bytes": range requests, block cache hits and bytes fetched as reported by
+              fsspec for remote files (zero when the fsspec version does not track them)
+            - "samples", "retries", "failed_samples": extracted, retried and finally failed samples
+        callback (callable, optional): Called as callback(event, stats) whenever a phase finishes or a counter changes.
+    """
+    def __init__(self, callback=None):
+        self.timings = {}
+        self.counters = {}
+        self.callback = callback
+
+    def add_time(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+        if self.callback is not None:
+            self.callback(name, self)
+
+    def add(self, key, n=1):
+        self.counters[key] = self.counters.get(key, 0) + n
+        if self.callback is not None:
+            self.callback(key, self)
+
+    def reset(self):
+        self.timings = {}
+        self.counters = {}
+
+    def __repr__(self):
+        timings = ", ".join("{}={:.3f}s".format(k, v) for k, v in self.timings.items())
+        counters = ", ".join("{}={}".format(k, v) for k, v in self.counters.items())
+        return "Stats(timings: {} | counters: {})".format(timings, counters)
+
+class _Phase:
+    __slots__ = ("stats", "name", "start")
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+def enable(callback=None):
+    """
+    Turn on instrumentation of archs4py.data, archs4py.meta and archs4py.utils calls.
+
+    Args:
+        callback (callable, optional): Function called as callback(event, stats) on every finished phase and counter update.
+
+    Returns:
+        Stats: The object that collects timings and counters until disable() is called.
+    """
+    global _stats
+    _stats = Stats(callback)
+    return _stats
+
+def disable():
+    """
+    Turn off instrumentation.
+
+    Returns:
+        Stats: The collected statistics, or None if profiling was not enabled.
+    """
+    global _stats
+    stats = _stats
+    _stats = None
+    return stats
+
+def enabled():
+    return _stats is not None
+
+@contextlib.contextmanager
+def profile(callback=None):
+    """
+    Context manager that profiles all archs4py calls made inside the block.
+
+    Args:
+        callback (callable, optional): Function called as callback(event, stats) on every finished phase and counter update.
+
+    Yields:
+        Stats: The object collecting timings and counters.
+
+    Example:
+        with archs4py.profiling.profile() as stats:
+            exp = archs4py.data.series(file, "GSE64016")
+        print(stats.timings, stats.counters)
+    """
+    global _stats
+    previous = _stats
+    _stats = Stats(callback)
+    try:
+        yield _stats
+    finally:
+        _stats = previous
+
+def phase(name):
+    if _stats is None:
+        return _null
+    return _Phase(_stats, name)
+
+def count(key, n=1):
+    if _stats is not None:
+        _stats.add(key, n)
@@ -0,0 +1,220 @@
+import numpy as np
+import pandas as pd
+import h5py as h5
+import tqdm
+
+import os
+
+from archs4py import data
+from archs4py import profiling
+from archs4py import utils
+
+BIN_WIDTH = 0.25
+NUMBER_BINS = 100
+_cache = {}
+
+def path(file):
+    """
+    Return the path of the summary statistics sidecar of an ARCHS4 file (e.g. human_gene_v2.6.summary.h5).
+    """
+    return os.path.splitext(file)[0] + ".summary.h5"
+
+def compute(file, output=None, block_size=500, tmm_outlier=0.05, thresholds=[0, 5, 10, 20, 50], silent=False):
+    """
+    Compute per-sample and per-gene summary statistics of an ARCHS4 file in one pass over data/expression and save them in a sidecar H5 file.
+
+    Args:
+        file (str): The file path of the ARCHS4 H5 file.
+        output (str, optional): Path of the sidecar file. Defaults to None (see archs4py.summary.path()).
+        block_size (int, optional): Number of samples read at a time. Defaults to 500.
+        tmm_outlier (float, optional): Fraction of values trimmed for the per-sample trimmed means used by TMM normalization. Defaults to 0.05.
+        thresholds (list, optional): Read thresholds for which the number of samples with larger counts is stored per gene.
+            Defaults to [0, 5, 10, 20, 50].
+        silent (bool, optional): Whether to disable progress bar. Defaults to False.
+
+    Returns:
+        str: The path of the sidecar file.
+
+    Notes:
+        The sidecar contains
+        - samples/geo_accession, genes/name: sample and gene identifiers in the order of data/expression
+        - samples/library_size: total read count per sample (used by CPM normalization)
+        - samples/trimmed_mean: trimmed mean of log2(1+counts) per sample (used by TMM normalization)
+        - genes/mean, genes/variance: mean and sample variance of the counts per gene
+        - genes/expressed: number of samples with counts above each threshold per gene (used by filter_genes)
+        - genes/histogram: histogram of log2(1+counts) per gene with bins of width 0.25 (used by gene_quantiles)
+    """
+    if output is None:
+        output = path(file)
+    with h5.File(file, "r") as f:
+        genes = np.array(f[data.encoding(f)])
+        gsm_ids = np.array(f["meta/samples/geo_accession"])
+        dset = f["data/expression"]
+        number_genes, number_samples = dset.shape
+        library_size = np.zeros(number_samples, dtype=np.float64)
+        trimmed_mean = np.zeros(number_samples, dtype=np.float32)
+        expressed = np.zeros((len(thresholds), number_genes), dtype=np.uint32)
+        histogram = np.zeros((number_genes, NUMBER_BINS), dtype=np.uint32)
+        mean = np.zeros(number_genes, dtype=np.float64)
+        m2 = np.zeros(number_genes, dtype=np.float64)
+        offsets = (np.arange(number_genes, dtype=np.int64)*NUMBER_BINS)[:, None]
+        count = 0
+        for start in tqdm.tqdm(range(0, number_samples, block_size), disable=silent):
+            with profiling.phase("extract"):
+                block = np.asarray(dset[:, start:start+block_size], dtype=np.uint32)
+            profiling.count("bytes_requested", block.nbytes)
+            profiling.count("samples", block.shape[1])
+            with profiling.phase("summarize"):
+                n = block.shape[1]
+                library_size[start:start+n] = block.sum(axis=0, dtype=np.float64)
+                lblock = np.log2(1+block).astype(np.float32)
+                trimmed_mean[start:start+n] = utils.trimmed_mean(lblock, tmm_outlier)
+                for t, threshold in enumerate(thresholds):
+                    expressed[t] += (block > threshold).sum(axis=1, dtype=np.uint32)
+                bins = np.minimum((lblock/BIN_WIDTH).astype(np.int64), NUMBER_BINS-1)
+                histogram += np.bincount((bins+offsets).ravel(), minlength=number_genes*NUMBER_BINS).reshape(number_genes, NUMBER_BINS).astype(np.uint32)
+                # merge the block mean and variance into the running totals (Chan et al.)
+                block_mean = block.mean(axis=1, dtype=np.float64)
+                block_m2 = block.var(axis=1, dtype=np.float64)*n
+                delta = block_mean-mean
+                mean += delta*n/(count+n)
+                m2 += block_m2+delta**2*count*n/(count+n)
+                count += n
+    with h5.File(output, "w") as out:
+        out.attrs["number_genes"] = number_genes
+        out.attrs["number_samples"] = number_samples
+        out.create_dataset("samples/geo_accession", data=gsm_ids, dtype=h5.string_dtype() if gsm_ids.dtype == object else None)
+        out.create_dataset("samples/library_size", data=library_size)
+        out.create_dataset("samples/trimmed_mean", data=trimmed_mean)
+        out["samples/trimmed_mean"].attrs["tmm_outlier"] = tmm_outlier
+        out.create_dataset("genes/name", data=genes, dtype=h5.string_dtype() if genes.dtype == object else None)
+        out.create_dataset("genes/mean", data=mean)
+        out.create_dataset("genes/variance", data=m2/max(count-1, 1))
+        out.create_dataset("genes/expressed", data=expressed)
+        out["genes/expressed"].attrs["thresholds"] = thresholds
+        out.create_dataset("genes/histogram", data=histogram, compression="gzip")
+        out["genes/histogram"].attrs["bin_width"] = BIN_WIDTH
+    _cache.pop(os.path.abspath(output), None)
+    return output
+
+def load(file):
+    """
+    Load the summary statistics sidecar of an ARCHS4 file.
+
+    Args:
+        file (str): The file path of the ARCHS4 H5 file.
+
+    Returns:
+        dict: The sidecar datasets keyed by their path (e.g. "samples/library_size") plus "number_genes", "number_samples",
+            "tmm_outlier", "thresholds" and "sample_positions", or None if no sidecar exists. Loaded sidecars are cached until
+            the sidecar file changes.
+    """
+    if file.startswith("http"):
+        return None
+    sidecar = os.path.abspath(path(file))
+    if not os.path.exists(sidecar):
+        return None
+    mtime = os.path.getmtime(sidecar)
+    if sidecar in _cache and _cache[sidecar][0] == mtime:
+        profiling.count("summary_cache_hits")
+        return _cache[sidecar][1]
+    with h5.File(sidecar, "r") as f, profiling.phase("summary_load"):
+        stats = {}
+        for group in ["samples", "genes"]:
+            for field in f[group].keys():
+                if field != "histogram":
+                    stats[group+"/"+field] = np.array(f[group][field])
+        stats["number_genes"] = int(f.attrs["number_genes"])
+        stats["number_samples"] = int(f.attrs["number_samples"])
+        stats["tmm_outlier"] = float(f["samples/trimmed_mean"].attrs["tmm_outlier"])
+        stats["thresholds"] = list(f["genes/expressed"].attrs["thresholds"])
+        stats["samples/geo_accession"] = np.array([x.decode("UTF-8") for x in stats["samples/geo_accession"]])
+        stats["genes/name"] = np.array([x.decode("UTF-8") for x in stats["genes/name"]])
+        stats["sample_positions"] = {x: i for i, x in enumerate(stats["samples/geo_accession"])}
+    _cache[sidecar] = (mtime, stats)
+    return stats
+
+def sample_stat(file, field, counts, tmm_outlier=None):
+    """
+    Look up a stored per-sample statistic for the columns of a count matrix loaded from an ARCHS4 file.
+    The values are only valid as long as counts hold the unmodified counts of all genes of the file.
+
+    Args:
+        file (str): The file path of the ARCHS4 H5 file the counts were loaded from.
+        field (str): "library_size" or "trimmed_mean".
+        counts (pd.DataFrame): Count matrix with genes as rows and GEO accessions as columns.
+        tmm_outlier (float, optional): Trim fraction the stored trimmed means must have been computed with.
+
+    Returns:
+        np.ndarray: The values of samples/<field> in the order of counts.columns.
+
+    Raises:
+        ValueError: If the file has no sidecar or the sidecar does not match the counts.
+    """
+    stats = load(file)
+    if stats is None:
+        raise ValueError("No summary statistics for " + file + ". Create them with archs4py.summary.compute()")
+    if counts.shape[0] != stats["number_genes"]:
+        raise ValueError("Stored sample statistics require all {} genes of the file, counts have {}".format(stats["number_genes"], counts.shape[0]))
+    if tmm_outlier is not None and tmm_outlier != stats["tmm_outlier"]:
+        raise ValueError("Stored trimmed means were computed with tmm_outlier={}".format(stats["tmm_outlier"]))
+    positions = stats["sample_positions"]
+    missing = [x for x in counts.columns if x not in positions]
+    if len(missing) > 0:
+        raise ValueError("Samples not found in " + file + ": " + ", ".join(str(x) for x in missing[:10]))
+    profiling.count("summary_hits")
+    return stats["samples/"+field][[positions[x] for x in counts.columns]]
+
+def expressed(file, threshold):
+    """
+    Number of samples of the whole ARCHS4 file with counts larger than threshold per gene.
+
+    Args:
+        file (str): The file path of the ARCHS4 H5 file.
+        threshold (int): One of the read thresholds stored by archs4py.summary.compute().
+
+    Returns:
+        tuple: A pd.Series of counts indexed by gene name (in file order, duplicates kept) and the number of samples in the file.
+
+    Raises:
+        ValueError: If the file has no sidecar or the threshold is not stored.
+    """
+    stats = load(file)
+    if stats is None:
+        raise ValueError("No summary statistics for " + file + ". Create them with archs4py.summary.compute()")
+    if threshold not in stats["thresholds"]:
+        raise ValueError("readThreshold {} is not stored, available thresholds: {}".format(threshold, [int(x) for x in stats["thresholds"]]))
+    profiling.count("summary_hits")
+    values = stats["genes/expressed"][stats["thresholds"].index(threshold)]
+    return pd.Series(values, index=stats["genes/name"]), stats["number_samples"]
+
+def gene_quantiles(file, q=[0.25, 0.5, 0.75]):
+    """
+    Approximate per-gene count quantiles from the histograms stored in the sidecar of an ARCHS4 file.
+
+    Args:
+        file (str): The file path of the ARCHS4 H5 file.
+        q (list, optional): Quantiles to compute. Defaults to [0.25, 0.5, 0.75].
+
+    Returns:
+        np.ndarray: Array of shape (genes, len(q)) with the approximate counts at each quantile.
+
+    Raises:
+        ValueError: If the file has no sidecar.
+    """
+    if file.startswith("http") or not os.path.exists(path(file)):
+        raise ValueError("No summary statistics for " + file + ". Create them with archs4py.summary.compute()")
+    with h5.File(path(file), "r") as f:
+        histogram = np.array(f["genes/histogram"], dtype=np.float64)
+        bin_width = f["genes/histogram"].attrs["bin_width"]
+    cumulative = np.cumsum(histogram, axis=1)
+    total = cumulative[:, -1:]
+    quantiles = []
+    for quantile in q:
+        target = quantile*total
+        b = np.minimum((cumulative < target).sum(axis=1), histogram.shape[1]-1)
+        below = np.take_along_axis(cumulative, b[:, None], axis=1)-np.take_along_axis(histogram, b[:, None], axis=1)
+        inside = np.take_along_axis(histogram, b[:, None], axis=1)
+        fraction = np.divide(target-below, inside, out=np.zeros_like(target), where=inside > 0)
+        quantiles.append(2**((b[:, None]+fraction)*bin_width)-1)
+    return np.hstack(quantiles)
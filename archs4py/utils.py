@@ -6,7 +6,7 @@ import random
 import os
 import json
 
-import qnorm
+from archs4py import profiling
 
 def get_config():
     config_url = os.path.join(
@@ -27,7 +27,7 @@ def versions():
     versions = config["GENE_COUNTS"]["HUMAN"].keys()
     return versions
 
-def normalize(counts, method="log_quantile", tmm_outlier=0.05):
+def normalize(counts, method="log_quantile", tmm_outlier=0.05, file=None):
     """
     Normalize the count matrix using a specified method.
 
@@ -38,30 +38,38 @@ def normalize(counts, method="log_quantile", tmm_outlier=0.05):
             - "log_quantile": Perform quantile normalization on the log-transformed counts.
             - "cpm": Perform count per million (CPM) normalization.
             - "tmm": Perform trimmed mean normalization
+        tmm_outlier (float, optional): Fraction of values trimmed for TMM normalization. Default is 0.05.
+        file (str, optional): ARCHS4 file the unmodified counts (all genes) were loaded from. If given, library sizes (cpm) and
+            trimmed means (tmm) are taken from its summary statistics sidecar (see archs4py.summary.compute()) instead of
+            being computed from counts. Default is None.
 
     Returns:
         pd.DataFrame: A normalized count matrix as a pandas DataFrame with the same index and columns as the input.
 
     Raises:
-        ValueError: If an unsupported normalization method is provided.
+        ValueError: If an unsupported normalization method is provided, or file is given and its summary statistics do not match counts.
     """
     norm_exp = 0
-    if method == "quantile":
-        norm_exp = qnorm.quantile_normalize(np.array(counts))
-    elif method == "log_quantile":
-        norm_exp = qnorm.quantile_normalize(np.log2(1+np.array(counts)))
-    elif method == "cpm":
-        norm_exp = cpm_normalization(counts)
-    elif method == "tmm":
-        norm_exp = tmm_norm(counts, tmm_outlier)
-    else:
-        raise ValueError("Unsupported normalization method: " + method)
-    norm_exp = pd.DataFrame(norm_exp, index=counts.index, columns=counts.columns, dtype=np.float32)
+    if method in ("quantile", "log_quantile"):
+        import qnorm
+    with profiling.phase("normalize"):
+        if method == "quantile":
+            norm_exp = qnorm.quantile_normalize(np.array(counts))
+        elif method == "log_quantile":
+            norm_exp = qnorm.quantile_normalize(np.log2(1+np.array(counts)))
+        elif method == "cpm":
+            norm_exp = cpm_normalization(counts, stored_sample_stat(file, "library_size", counts))
+        elif method == "tmm":
+            norm_exp = tmm_norm(counts, tmm_outlier, stored_sample_stat(file, "trimmed_mean", counts, tmm_outlier))
+        else:
+            raise ValueError("Unsupported normalization method: " + method)
+        norm_exp = pd.DataFrame(norm_exp, index=counts.index, columns=counts.columns, dtype=np.float32)
     return norm_exp
 
-def tmm_norm(exp, percentage=0.05):
+def tmm_norm(exp, percentage=0.05, tmm=None):
     lexp = np.log2(1+exp).astype(np.float32)
-    tmm = trimmed_mean(lexp, percentage)
+    if tmm is None:
+        tmm = trimmed_mean(lexp, percentage)
     nf = pd.DataFrame(np.tile(tmm, (exp.shape[0], 1)), index=lexp.index, columns=lexp.columns)
     temp = (lexp/nf)
     return temp
@@ -79,12 +87,19 @@ def trimmed_mean(matrix, percentage):
         trimmed_means.append(trimmed_mean)
     return trimmed_means
 
-def cpm_normalization(df):
-    sample_sum = df.sum(axis=0)
+def cpm_normalization(df, sample_sum=None):
+    if sample_sum is None:
+        sample_sum = df.sum(axis=0)
     scaling_factor = sample_sum / 1e6
     normalized_df = df / scaling_factor
     return normalized_df
 
+def stored_sample_stat(file, field, counts, tmm_outlier=None):
+    if file is None:
+        return None
+    from archs4py import summary
+    return summary.sample_stat(file, field, counts, tmm_outlier)
+
 def ls(file):
     """
     List all meta data groups and meta data fields in the specified H5 file.
@@ -118,7 +133,7 @@ def ls(file):
 def aggregate_duplicate_genes(exp):
     return exp.groupby(exp.index).sum()
 
-def filter_genes(exp, readThreshold: int=20, sampleThreshold: float=0.02, deterministic: bool=True, aggregate=True):
+def filter_genes(exp, readThreshold: int=20, sampleThreshold: float=0.02, deterministic: bool=True, aggregate=True, file=None):
     '''
     Returns filtered genes with sufficient read support
         Parameters:
@@ -126,6 +141,10 @@ def filter_genes(exp, readThreshold: int=20, sampleThreshold: float=0.02, determ
                 readThreshold      (int): minimum number of reads required for gene filtering
                 sampleThreshold  (float): fraction of samples required with read count larger than _readThreshold
                 filterSamples      (int): number of samples used to identify genes for clustering
+                file            (string): whole-file mode, keep the genes of exp that pass the thresholds across all samples of this
+                                          ARCHS4 file, using its summary statistics (see archs4py.summary.compute()). readThreshold
+                                          must be one of the stored thresholds. Unless exp has all genes in file order (as returned
+                                          by archs4py.data), duplicate gene names pass if any of their entries passes.
 
         Returns:
                 (List[int]): filtered index of genes passing criteria
@@ -134,8 +153,18 @@ def filter_genes(exp, readThreshold: int=20, sampleThreshold: float=0.02, determ
         random.seed(42)
 
     if aggregate:
-        exp = aggregate_duplicate_genes(exp)
-
-    kk = exp[exp > readThreshold].count(axis=1)
-    ii = [idx for idx, val in enumerate(kk) if val >= exp.shape[1]*sampleThreshold]
+        with profiling.phase("aggregate"):
+            exp = aggregate_duplicate_genes(exp)
+
+    with profiling.phase("filter"):
+        if file is not None:
+            from archs4py import summary
+            expressed, number_samples = summary.expressed(file, readThreshold)
+            passing = expressed >= number_samples*sampleThreshold
+            if not exp.index.equals(passing.index):
+                passing = passing.groupby(level=0).any().reindex(exp.index, fill_value=False)
+            ii = np.where(passing.values)[0]
+        else:
+            kk = exp[exp > readThreshold].count(axis=1)
+            ii = [idx for idx, val in enumerate(kk) if val >= exp.shape[1]*sampleThreshold]
     return exp.iloc[ii,:]
@@ -0,0 +1,53 @@
+"""
+Check that `import archs4py` stays fast and does not pull in heavy dependencies.
+
+The import is timed in a fresh interpreter (best of several runs). The check fails
+if it exceeds the time budget or if any heavy module is loaded eagerly. Run in CI with
+
+    python scripts/check_import_time.py --budget 0.25
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HEAVY_MODULES = ["h5py", "pandas", "s3fs", "qnorm", "wget", "xalign", "biomart", "tqdm", "pyarrow", "anndata"]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import archs4py
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+def measure(repeat):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = root + os.pathsep + env.get("PYTHONPATH", "")
+    results = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", PROBE], env=env, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(out))
+    return min(r["elapsed"] for r in results), results[0]["loaded"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time budget of archs4py.")
+    parser.add_argument("--budget", type=float, default=0.25, help="maximum import time in seconds")
+    parser.add_argument("--repeat", type=int, default=5, help="number of fresh interpreter runs")
+    args = parser.parse_args()
+
+    elapsed, loaded = measure(args.repeat)
+    print("import archs4py: {:.4f}s (budget {:.4f}s)".format(elapsed, args.budget))
+    failed = False
+    if loaded:
+        print("heavy modules imported eagerly:", ", ".join(loaded))
+        failed = True
+    if elapsed > args.budget:
+        print("import time budget exceeded")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
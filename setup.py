@@ -30,10 +30,13 @@ setuptools.setup(
         'setuptools',
         'tqdm',
         'wget',
-        's3fs',
-        'biomart',
-        'xalign'
-
+        'requests'
     ],
+    extras_require={
+        'remote': ['s3fs'],
+        'align': ['xalign', 'biomart'],
+        'export': ['pyarrow', 'anndata'],
+        'all': ['s3fs', 'xalign', 'biomart', 'pyarrow', 'anndata']
+    },
     python_requires='>=3.8',
 )
\ No newline at end of file